@@ -2,18 +2,18 @@
 #依存関係のインポート
 #------------------------------
 from __future__ import annotations
-import json
 import os
 import secrets
 import sqlite3
 import time
 from datetime import datetime, timedelta, timezone
-from functools import wraps
+from functools import lru_cache, wraps
 from pathlib import Path
 from typing import Any, Dict, List
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
-from flask import Flask, abort, redirect, render_template, request, session, url_for
+from flask import Flask, abort, g, redirect, render_template, request, session, url_for
+import orjson
 from recipe import fetch_recipe_by_id, fetch_category_ranking, normalize_recipe, suggest_categories  # type: ignore
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
@@ -66,8 +66,9 @@ DAILY_REFILL = 1000
 REFILL_HOUR_JST = 4
 
 # -----------------------------
-# Rakuten App ID
+# Rakuten App ID（実行中に変わらないので初回の結果を使い回す）
 # -----------------------------
+@lru_cache(maxsize=1)
 def get_rakuten_app_id() -> str:
     app_id = (os.getenv("RAKUTEN_APP_ID") or "").strip()
     if not app_id:
@@ -79,26 +80,150 @@ def get_rakuten_app_id() -> str:
 # -----------------------------
 def safe_external_url(url: str) -> bool:
     """Allow only http(s) URLs."""
+    if not isinstance(url, str):
+        return False
+    # スキーム部分を先に見て、明らかに弾くURLでは urlparse を呼ばない
+    head = url[:8].lower()
+    if not (head.startswith("https://") or head.startswith("http://")):
+        return False
     try:
-        u = urlparse(url)
-        return u.scheme in ("http", "https") and bool(u.netloc)
+        return bool(urlparse(url).netloc)
     except Exception:
         return False
 
+#-----------------------------
+#LIKE 検索用に % _ \ をエスケープする関数
+#-----------------------------
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+#-----------------------------
+#よく使うSQL（文字列を共通化して接続ごとの prepared statement キャッシュに載せる）
+#-----------------------------
+SQL_GET_USER = "SELECT * FROM users WHERE id = ?"
+SQL_GET_USER_BY_SUB = "SELECT * FROM users WHERE google_sub = ?"
+SQL_INSERT_USER = """
+INSERT INTO users (google_sub, email, name, picture, created_at)
+VALUES (?, ?, ?, ?, ?)
+"""
+SQL_ENSURE_TOKENS_SELECT = "SELECT tokens FROM user_tokens WHERE user_id = ?"
+# 今回の回復時刻まで回復済みなら残数を返す（書き込みロック不要の読み出しで済ませる）
+SQL_TOKENS_IF_REFILLED = """
+SELECT tokens FROM user_tokens
+WHERE user_id = ? AND julianday(last_refill_at) >= julianday(?)
+"""
+# 初回は MAX_TOKENS で作成、前回の回復時刻より新しい回復時刻なら JST の経過日数ぶん回復する
+SQL_ENSURE_TOKENS_UPSERT = """
+INSERT INTO user_tokens (user_id, tokens, last_refill_at) VALUES (:user_id, :max_tokens, :boundary)
+ON CONFLICT(user_id) DO UPDATE SET
+    tokens = min(
+        :max_tokens,
+        tokens + CAST(
+            julianday(date(excluded.last_refill_at, :tz_offset))
+            - julianday(date(last_refill_at, :tz_offset))
+            AS INTEGER
+        ) * :daily_refill
+    ),
+    last_refill_at = excluded.last_refill_at
+WHERE julianday(last_refill_at) < julianday(excluded.last_refill_at)
+RETURNING tokens
+"""
+SQL_SET_TOKENS = "UPDATE user_tokens SET tokens = ? WHERE user_id = ?"
+SQL_CONSUME_TOKEN = "UPDATE user_tokens SET tokens = tokens - 1 WHERE user_id = ? AND tokens > 0"
+# 一覧の各行にトークン残数も載せて、トークン読み出しの往復を省く
+SQL_INDEX_ROWS = """
+SELECT r.*, (SELECT tokens FROM user_tokens WHERE user_id = ?1) AS user_tokens
+FROM recipes r
+JOIN user_recipes ur ON ur.recipe_id = r.recipe_id
+WHERE ur.user_id = ?1
+"""
+SQL_INDEX_SEARCH_ROWS = SQL_INDEX_ROWS + """
+  AND r.search_blob LIKE ? ESCAPE '\\'
+"""
+SQL_COUNT_USER_RECIPES = """
+SELECT COUNT(*) AS n, (SELECT tokens FROM user_tokens WHERE user_id = ?1) AS user_tokens
+FROM user_recipes
+WHERE user_id = ?1
+"""
+SQL_TOKENS_AND_OWNS = """
+SELECT tokens,
+       EXISTS(SELECT 1 FROM user_recipes WHERE user_id = ?1 AND recipe_id = ?2) AS owned
+FROM user_tokens
+WHERE user_id = ?1
+"""
+SQL_OPEN_RECIPE = """
+SELECT r.url
+FROM recipes r
+JOIN user_recipes ur ON ur.recipe_id = r.recipe_id
+WHERE ur.user_id = ? AND ur.recipe_id = ?
+"""
+SQL_INSERT_RECIPE = """
+INSERT OR REPLACE INTO recipes
+(recipe_id, title, description, materials, time, cost, rank, pickup, image, url, publish_day, nickname, shop, source_category_id, search_blob)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_USER_RECIPE = "INSERT OR IGNORE INTO user_recipes (user_id, recipe_id, added_at) VALUES (?, ?, ?)"
+SQL_LINK_USER_RECIPE = """
+INSERT INTO user_recipes (user_id, recipe_id, added_at) VALUES (?, ?, ?)
+ON CONFLICT DO NOTHING
+RETURNING 1
+"""
+
 #-----------------------------
 #Sqlite DBを接続する関数
 #-----------------------------
-def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# 接続ごとに適用する設定（WAL 下の synchronous=NORMAL でコミット時の fsync を減らす）
+# journal_mode=WAL は DB ファイルに残るので init_db で1回だけ設定する
+SQLITE_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=134217728;
+PRAGMA foreign_keys=ON;
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
+    conn.executescript(SQLITE_PRAGMAS)
     return conn
 
 
+def get_db() -> sqlite3.Connection:
+    """リクエスト中は g に保持した接続を使い回す。"""
+    if "db" not in g:
+        g.db = _connect()
+    return g.db
+
+
+@app.teardown_appcontext
+def _close_db(e: BaseException | None = None) -> None:
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+
+
 #-----------------------------
 #DBを作成する関数
 #-----------------------------
+# スキーマを変えたら上げる（PRAGMA user_version と比較して作成済みなら何もしない）
+SCHEMA_VERSION = 3
+
+
 def init_db() -> None:
-    with get_db() as db:
+    # import 時はアプリコンテキスト外なので専用の接続を開いて閉じる
+    db = _connect()
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        ver = db.execute("PRAGMA user_version").fetchone()[0]
+        if ver >= SCHEMA_VERSION:
+            return
         db.executescript(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -124,7 +249,8 @@ def init_db() -> None:
                 publish_day TEXT,
                 nickname TEXT,
                 shop INTEGER,
-                source_category_id TEXT
+                source_category_id TEXT,
+                search_blob TEXT
             );
 
             CREATE TABLE IF NOT EXISTS user_recipes (
@@ -142,8 +268,43 @@ def init_db() -> None:
                 last_refill_at TEXT NOT NULL,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             );
+
+            -- user_recipes は主キー (user_id, recipe_id) がそのまま索引になる
+            CREATE INDEX IF NOT EXISTS idx_recipes_source_cat ON recipes(source_category_id);
+            -- open_recipe の url 取得を索引だけで済ませる
+            CREATE INDEX IF NOT EXISTS idx_recipes_url ON recipes(recipe_id, url);
+
+            ANALYZE;
             """
         )
+        if ver < 3:
+            _backfill_search_blob(db)
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    finally:
+        db.close()
+
+#-----------------------------
+#search_blob 列を追加して既存レシピ分を埋める（SCHEMA_VERSION 3 への移行）
+#-----------------------------
+def _backfill_search_blob(db: sqlite3.Connection) -> None:
+    cols = {row["name"] for row in db.execute("PRAGMA table_info(recipes)")}
+    if "search_blob" not in cols:
+        db.execute("ALTER TABLE recipes ADD COLUMN search_blob TEXT")
+
+    rows = db.execute(
+        "SELECT recipe_id, title, materials FROM recipes WHERE search_blob IS NULL"
+    ).fetchall()
+    updates = []
+    for row in rows:
+        try:
+            mats = orjson.loads(row["materials"]) if row["materials"] else []
+        except Exception:
+            mats = []
+        updates.append((_search_blob(row["title"], mats), row["recipe_id"]))
+
+    db.execute("BEGIN")
+    db.executemany("UPDATE recipes SET search_blob = ? WHERE recipe_id = ?", updates)
+    db.commit()
 
 #-----------------------------
 #直近の回復時刻（JST 4:00）を確認する関数
@@ -158,64 +319,97 @@ def most_recent_refill_boundary(now_jst: datetime) -> datetime:
 #ユーザのトークンを確認・回復する関数
 #-----------------------------
 
-def ensure_user_tokens(db: sqlite3.Connection, user_id: int) -> int:
-    row = db.execute(
-        "SELECT tokens, last_refill_at FROM user_tokens WHERE user_id = ?",
-        (user_id,),
-    ).fetchone()
-
+def _refill_user_tokens(db: sqlite3.Connection, user_id: int) -> tuple[int | None, bool]:
+    """(トークン数, 今回初回作成・回復したか) を返す。回復不要ならトークン数は読み出し値。"""
     now_jst = datetime.now(tz=JST)
     current_boundary = most_recent_refill_boundary(now_jst)
-    current_boundary_utc = current_boundary.astimezone(timezone.utc)
+    boundary_iso = current_boundary.astimezone(timezone.utc).isoformat()
 
+    #ほとんどのリクエストは回復不要なので、まず読み出しだけで判定する
+    row = db.execute(SQL_TOKENS_IF_REFILLED, (user_id, boundary_iso)).fetchone()
+    if row is not None:
+        return int(row["tokens"]), False
+
+    #初回作成・回復をUPSERT1文で行い、更新後のトークン数を RETURNING で受け取る
+    offset_hours = int(current_boundary.utcoffset().total_seconds() // 3600)
+    row = db.execute(
+        SQL_ENSURE_TOKENS_UPSERT,
+        {
+            "user_id": user_id,
+            "max_tokens": MAX_TOKENS,
+            "daily_refill": DAILY_REFILL,
+            "boundary": boundary_iso,
+            "tz_offset": f"{offset_hours:+d} hours",
+        },
+    ).fetchone()
     if row is None:
-        db.execute(
-            "INSERT INTO user_tokens (user_id, tokens, last_refill_at) VALUES (?, ?, ?)",
-            (user_id, MAX_TOKENS, current_boundary_utc.isoformat()),
-        )
-        return MAX_TOKENS
+        #読み出しとUPSERTの間に別リクエストが回復を済ませた
+        return None, False
+    return int(row["tokens"]), True
 
-    tokens = int(row["tokens"])
-    last_refill_at_raw = row["last_refill_at"]
-    try:
-        last_refill_at = datetime.fromisoformat(last_refill_at_raw)
-    except Exception:
-        last_refill_at = current_boundary_utc
-
-    last_refill_jst = last_refill_at.astimezone(JST)
-    if last_refill_jst > current_boundary:
-        last_refill_jst = current_boundary
-
-#経過日数を計算してその日数分トークンを回復
-    delta_days = (current_boundary.date() - last_refill_jst.date()).days
-    if delta_days > 0:
-        tokens = min(MAX_TOKENS, tokens + delta_days * DAILY_REFILL)
-        db.execute(
-            "UPDATE user_tokens SET tokens = ?, last_refill_at = ? WHERE user_id = ?",
-            (tokens, current_boundary_utc.isoformat(), user_id),
-        )
 
+def refill_user_tokens(db: sqlite3.Connection, user_id: int) -> int | None:
+    """初回作成・回復が必要なら行い、そのときのトークン数を返す（不要なら None）。"""
+    tokens, refilled = _refill_user_tokens(db, user_id)
+    return tokens if refilled else None
+
+
+def ensure_user_tokens(db: sqlite3.Connection, user_id: int) -> int:
+    tokens, _ = _refill_user_tokens(db, user_id)
+    if tokens is None:
+        tokens = int(db.execute(SQL_ENSURE_TOKENS_SELECT, (user_id,)).fetchone()["tokens"])
     return tokens
 
 #-----------------------------
 #ユーザのトークンを設定する関数
 #-----------------------------
 def set_user_tokens(db: sqlite3.Connection, user_id: int, tokens: int) -> None:
-    db.execute(
-        "UPDATE user_tokens SET tokens = ? WHERE user_id = ?",
-        (tokens, user_id),
+    db.execute(SQL_SET_TOKENS, (tokens, user_id))
+
+#-----------------------------
+#検索用にタイトルと材料をつないで小文字化した文字列を作る関数
+#-----------------------------
+def _search_blob(title: str | None, materials: List[Any]) -> str:
+    return " ".join([title or "", *map(str, materials)]).lower()
+
+#-----------------------------
+#recipes テーブルへの INSERT 用パラメータを作る関数
+#-----------------------------
+def _recipe_row(rid_str: str, r: Dict[str, Any]) -> tuple:
+    materials = r.get("materials") or []
+    return (
+        rid_str,
+        r.get("title"),
+        r.get("description"),
+        # orjson は UTF-8 のまま出力するので ensure_ascii=False と同じ形で保存される
+        orjson.dumps(materials).decode(),
+        r.get("time"),
+        r.get("cost"),
+        str(r.get("rank") or ""),
+        int(r.get("pickup") or 0),
+        r.get("image"),
+        r.get("url"),
+        r.get("publishDay"),
+        r.get("nickname"),
+        int(r.get("shop") or 0),
+        r.get("sourceCategoryId"),
+        _search_blob(r.get("title"), materials),
     )
 
 #-----------------------------
 #uidが存在していればそのユーザ情報を取得する関数
 #-----------------------------
 def get_current_user() -> Dict[str, Any] | None:
+    # 同一リクエスト内では g に保持した結果を返す
+    if "user" in g:
+        return g.user
     uid = session.get("user_id")
     if not uid:
         return None
-    with get_db() as db:
-        row = db.execute("SELECT * FROM users WHERE id = ?", (uid,)).fetchone()
-    return dict(row) if row else None
+    db = get_db()
+    row = db.execute(SQL_GET_USER, (uid,)).fetchone()
+    g.user = dict(row) if row else None
+    return g.user
 
 #-----------------------------
 #未ログインならログインへ
@@ -233,10 +427,15 @@ def login_required(fn):
 #CSRFトークンを発行・検証
 #-----------------------------
 def get_csrf_token() -> str:
+    token = g.get("_csrf")
+    if token:
+        return token
     token = session.get("csrf_token")
     if not token:
+        # 未発行のときだけ session に書き込む（既存トークンの再書き込みで Cookie を更新しない）
         token = secrets.token_urlsafe(32)
         session["csrf_token"] = token
+    g._csrf = token
     return token
 
 
@@ -246,6 +445,18 @@ def require_csrf() -> None:
     if not token or not secrets.compare_digest(token, session_token):
         abort(400, description="Invalid CSRF token.")
 
+#-----------------------------
+#材料などのJSON文字列をテンプレート内で配列に戻すフィルタ
+#-----------------------------
+@app.template_filter("fromjson")
+def fromjson_filter(raw: Any) -> List[Any]:
+    if not isinstance(raw, str):
+        return raw or []
+    try:
+        return orjson.loads(raw)
+    except Exception:
+        return []
+
 #-----------------------------
 #テーブル（スキーマ）を作成
 #-----------------------------
@@ -258,48 +469,27 @@ init_db()
 def index():
     user = get_current_user()
 
-    #ユーザーのレシピ一覧を取得
-    with get_db() as db:
-        tokens = ensure_user_tokens(db, user["id"])
-        rows = db.execute(
-            """
-            SELECT r.*
-            FROM recipes r
-            JOIN user_recipes ur ON ur.recipe_id = r.recipe_id
-            WHERE ur.user_id = ?
-            """,
-            (user["id"],),
-        ).fetchall()
-
-    recipes = []
-
-    #材料をJSON配列に変換
-    for r in rows:
-        item = dict(r)
-        mats_raw = item.get("materials")
-        if isinstance(mats_raw, str):
-            try:
-                item["materials"] = json.loads(mats_raw)
-            except Exception:
-                item["materials"] = []
-        recipes.append(item)
-
-    # 検索クエリがあればフィルタリング
     q = (request.args.get("q") or "").strip()
-    items = recipes
 
-    #qを小文字化してタイトルと材料に含まれるか確認
+    #ユーザーのレシピ一覧を取得（検索クエリがあれば search_blob でDB側で絞り込む）
+    db = get_db()
+    tokens = refill_user_tokens(db, user["id"])
     if q:
-        q_low = q.lower()
-
-        #
-        def hit(r: Dict[str, Any]) -> bool:
-            title = (r.get("title") or "")
-            mats = r.get("materials") or []
-            blob = " ".join([title, *mats])
-            return q_low in blob.lower()
-
-        items = [r for r in recipes if hit(r)]
+        pattern = f"%{_escape_like(q.lower())}%"
+        rows = db.execute(SQL_INDEX_SEARCH_ROWS, (user["id"], pattern)).fetchall()
+        count_row = db.execute(SQL_COUNT_USER_RECIPES, (user["id"],)).fetchone()
+        count = count_row["n"]
+        stored_tokens = count_row["user_tokens"]
+    else:
+        rows = db.execute(SQL_INDEX_ROWS, (user["id"],)).fetchall()
+        count = len(rows)
+        stored_tokens = rows[0]["user_tokens"] if rows else None
+
+    #回復が走らなかったときは一覧と一緒に読んだ残数を使う（レシピ0件なら別途読む）
+    if tokens is None:
+        if stored_tokens is None:
+            stored_tokens = db.execute(SQL_ENSURE_TOKENS_SELECT, (user["id"],)).fetchone()["tokens"]
+        tokens = int(stored_tokens)
 
     #データ生成元
     generated_at = "user-db"
@@ -309,8 +499,10 @@ def index():
 
     return render_template(
         INDEX_TMPL,
-        recipes=items,
-        count=len(recipes),
+        # sqlite3.Row はテンプレートから r.title のように参照できるので dict に変換しない
+        # （材料のJSON文字列は fromjson フィルタで表示時に変換する）
+        recipes=rows,
+        count=count,
         generated_at=generated_at,
         q=q,
         msg=msg,
@@ -351,56 +543,42 @@ def add_category():
 
     added = 0
     skipped = 0
-    with get_db() as db:
-        tokens = ensure_user_tokens(db, user["id"])
-        owned = db.execute(
-            "SELECT recipe_id FROM user_recipes WHERE user_id = ?",
-            (user["id"],),
-        ).fetchall()
-        owned_ids = {str(r["recipe_id"]) for r in owned}
-
-        for r in new_recipes:
-            rid = r.get("recipeId")
-            if rid is None:
-                continue
-            rid_str = str(rid)
-            if rid_str in owned_ids:
-                skipped += 1
-                continue
-            if tokens <= 0:
-                break
-
-            db.execute(
-                """
-                INSERT OR REPLACE INTO recipes
-                (recipe_id, title, description, materials, time, cost, rank, pickup, image, url, publish_day, nickname, shop, source_category_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    rid_str,
-                    r.get("title"),
-                    r.get("description"),
-                    json.dumps(r.get("materials") or [], ensure_ascii=False),
-                    r.get("time"),
-                    r.get("cost"),
-                    str(r.get("rank") or ""),
-                    int(r.get("pickup") or 0),
-                    r.get("image"),
-                    r.get("url"),
-                    r.get("publishDay"),
-                    r.get("nickname"),
-                    int(r.get("shop") or 0),
-                    r.get("sourceCategoryId"),
-                ),
-            )
-            db.execute(
-                "INSERT OR IGNORE INTO user_recipes (user_id, recipe_id, added_at) VALUES (?, ?, ?)",
-                (user["id"], rid_str, datetime.now(tz=timezone.utc).isoformat()),
-            )
-            tokens -= 1
-            added += 1
-
-        set_user_tokens(db, user["id"], tokens)
+    now_iso = datetime.now(tz=timezone.utc).isoformat()
+    db = get_db()
+    #読み出しの後に書き込むので、WAL で途中の書き込みに負けないよう最初に書き込みロックを取る
+    db.execute("BEGIN IMMEDIATE")
+    tokens = ensure_user_tokens(db, user["id"])
+
+    #追加候補の行をまとめる（所持済みかどうかは user_recipes の主キーで判定）
+    pending = []
+    for r in new_recipes:
+        rid = r.get("recipeId")
+        if rid is None:
+            continue
+        rid_str = str(rid)
+        pending.append((_recipe_row(rid_str, r), (user["id"], rid_str, now_iso)))
+
+    #トークン残数ぶんずつ一括INSERTし、実際に増えた行数で追加件数を数える
+    while pending and tokens > 0:
+        chunk, pending = pending[:tokens], pending[tokens:]
+        db.executemany(SQL_INSERT_RECIPE, [recipe_row for recipe_row, _ in chunk])
+        before = db.total_changes
+        db.executemany(SQL_INSERT_USER_RECIPE, [link_row for _, link_row in chunk])
+        inserted = db.total_changes - before
+        added += inserted
+        skipped += len(chunk) - inserted
+        tokens -= inserted
+
+    #トークン切れで残った候補のうち所持済みのものも「既存」に数える
+    if pending:
+        rest_ids = [link_row[1] for _, link_row in pending]
+        skipped += db.execute(
+            f"SELECT COUNT(*) FROM user_recipes WHERE user_id = ? AND recipe_id IN ({','.join('?' * len(rest_ids))})",
+            (user["id"], *rest_ids),
+        ).fetchone()[0]
+
+    set_user_tokens(db, user["id"], tokens)
+    db.commit()
 
     return redirect(
         url_for(
@@ -419,6 +597,10 @@ def login():
     next_url = (request.args.get("next") or "").strip()
     if next_url:
         session["next_url"] = next_url
+    if not session.get("user_id") and not next_url:
+        # 未ログイン時のログイン画面は内容が固定なので短時間キャッシュさせる
+        # （next 付きは session へ保存する処理を毎回通すためキャッシュさせない）
+        return render_template(LOGIN_TMPL), {"Cache-Control": "private, max-age=60"}
     return render_template(LOGIN_TMPL)
 
 #-----------------------------
@@ -450,26 +632,17 @@ def auth_google_callback():
     picture = userinfo.get("picture") or ""
     now_utc = datetime.now(tz=timezone.utc).isoformat()
 
-    with get_db() as db:
-        row = db.execute(
-            "SELECT * FROM users WHERE google_sub = ?",
-            (google_sub,),
-        ).fetchone()
-        if row is None:
-            db.execute(
-                """
-                INSERT INTO users (google_sub, email, name, picture, created_at)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (google_sub, email, name, picture, now_utc),
-            )
-            row = db.execute(
-                "SELECT * FROM users WHERE google_sub = ?",
-                (google_sub,),
-            ).fetchone()
-
-        session["user_id"] = row["id"]
-        ensure_user_tokens(db, row["id"])
+    db = get_db()
+    #読み出しの後に書き込むので最初に書き込みロックを取る（add_category と同じ）
+    db.execute("BEGIN IMMEDIATE")
+    row = db.execute(SQL_GET_USER_BY_SUB, (google_sub,)).fetchone()
+    if row is None:
+        db.execute(SQL_INSERT_USER, (google_sub, email, name, picture, now_utc))
+        row = db.execute(SQL_GET_USER_BY_SUB, (google_sub,)).fetchone()
+
+    session["user_id"] = row["id"]
+    ensure_user_tokens(db, row["id"])
+    db.commit()
 
     next_url = session.pop("next_url", None)
     return redirect(next_url or url_for("index"))
@@ -490,25 +663,20 @@ def logout():
 @login_required
 def open_recipe(recipe_id: str):
     user = get_current_user()
-    with get_db() as db:
-        row = db.execute(
-            """
-            SELECT r.url
-            FROM recipes r
-            JOIN user_recipes ur ON ur.recipe_id = r.recipe_id
-            WHERE ur.user_id = ? AND ur.recipe_id = ?
-            """,
-            (user["id"], str(recipe_id)),
-        ).fetchone()
+    db = get_db()
+    row = db.execute(SQL_OPEN_RECIPE, (user["id"], str(recipe_id))).fetchone()
 
     if not row:
         abort(404, description="recipeId not found")
 
     url = row["url"]
-    if not isinstance(url, str) or not safe_external_url(url):
+    if not safe_external_url(url):
         abort(400, description="invalid recipe url")
 
-    return redirect(url, code=302)
+    # 同じレシピを続けて開いたときはブラウザのキャッシュでリダイレクトさせる
+    resp = redirect(url, code=302)
+    resp.headers["Cache-Control"] = "private, max-age=300"
+    return resp
 
 #-----------------------------
 #レシピ追加フォームを表示する関数
@@ -529,8 +697,7 @@ def add_recipe_form():
         except Exception as e:
             cat_error = str(e)
 
-    with get_db() as db:
-        tokens = ensure_user_tokens(db, user["id"])
+    tokens = ensure_user_tokens(get_db(), user["id"])
 
     return render_template(
         ADD_FORM_HTML,
@@ -569,37 +736,34 @@ def add_recipe():
             csrf_token=csrf_token,
         ), 400
 
-    with get_db() as db:
-        tokens = ensure_user_tokens(db, user["id"])
-        if tokens <= 0:
-            return render_template(
-                ADD_FORM_HTML,
-                error="トークンが不足しています。午前4時（JST）に回復します。",
-                ok="",
-                cq="",
-                cat_error="",
-                suggestions=[],
-                tokens=tokens,
-                csrf_token=csrf_token,
-            ), 403
-
-        owned = db.execute(
-            "SELECT 1 FROM user_recipes WHERE user_id = ? AND recipe_id = ?",
-            (user["id"], recipe_id),
-        ).fetchone()
-
-        if owned:
-            return render_template(
-                ADD_FORM_HTML,
-                error="",
-                ok="すでにあなたの一覧に入っています。",
-                cq="",
-                cat_error="",
-                suggestions=[],
-                tokens=tokens,
-                csrf_token=csrf_token,
-            )
+    #トークン残数と所持済みかどうかを1回のSELECTで読む
+    db = get_db()
+    refilled = refill_user_tokens(db, user["id"])
+    status = db.execute(SQL_TOKENS_AND_OWNS, (user["id"], recipe_id)).fetchone()
+    tokens = refilled if refilled is not None else int(status["tokens"])
+    if tokens <= 0:
+        return render_template(
+            ADD_FORM_HTML,
+            error="トークンが不足しています。午前4時（JST）に回復します。",
+            ok="",
+            cq="",
+            cat_error="",
+            suggestions=[],
+            tokens=tokens,
+            csrf_token=csrf_token,
+        ), 403
 
+    if status["owned"]:
+        return render_template(
+            ADD_FORM_HTML,
+            error="",
+            ok="すでにあなたの一覧に入っています。",
+            cq="",
+            cat_error="",
+            suggestions=[],
+            tokens=tokens,
+            csrf_token=csrf_token,
+        )
 
     r = fetch_recipe_by_id(recipe_id)
     if not r:
@@ -611,35 +775,31 @@ def add_recipe():
             csrf_token=csrf_token,
         ), 404
 
-    with get_db() as db:
-        db.execute(
-            """
-            INSERT OR REPLACE INTO recipes
-            (recipe_id, title, description, materials, time, cost, rank, pickup, image, url, publish_day, nickname, shop, source_category_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                str(r.get("recipeId")),
-                r.get("title"),
-                r.get("description"),
-                json.dumps(r.get("materials") or [], ensure_ascii=False),
-                r.get("time"),
-                r.get("cost"),
-                str(r.get("rank") or ""),
-                int(r.get("pickup") or 0),
-                r.get("image"),
-                r.get("url"),
-                r.get("publishDay"),
-                r.get("nickname"),
-                int(r.get("shop") or 0),
-                r.get("sourceCategoryId"),
-            ),
-        )
-        db.execute(
-            "INSERT OR IGNORE INTO user_recipes (user_id, recipe_id, added_at) VALUES (?, ?, ?)",
-            (user["id"], str(r.get("recipeId")), datetime.now(tz=timezone.utc).isoformat()),
+    #レシピ登録・所持追加・トークン消費を1トランザクションで行う
+    rid_str = str(r.get("recipeId"))
+    now_iso = datetime.now(tz=timezone.utc).isoformat()
+    db.execute("BEGIN")
+    db.execute(SQL_INSERT_RECIPE, _recipe_row(rid_str, r))
+    #ON CONFLICT DO NOTHING RETURNING で重複判定と追加を1文で行う
+    linked = db.execute(
+        SQL_LINK_USER_RECIPE,
+        (user["id"], rid_str, now_iso),
+    ).fetchone()
+    if linked is None:
+        # 取得中に別リクエストで追加済みになった場合
+        db.rollback()
+        return render_template(
+            ADD_FORM_HTML,
+            error="",
+            ok="すでにあなたの一覧に入っています。",
+            cq="",
+            cat_error="",
+            suggestions=[],
+            tokens=tokens,
+            csrf_token=csrf_token,
         )
-        set_user_tokens(db, user["id"], tokens - 1)
+    db.execute(SQL_CONSUME_TOKEN, (user["id"],))
+    db.commit()
 
     # Redirect back to index with a small message
     return redirect(url_for("index", msg=f"recipeId={recipe_id} を追加しました"), code=302)
@@ -1,50 +1,183 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
+import heapq
 import os
 import time
-import json
 import random
-from typing import Dict, Any, List, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlencode
 import re
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # C-based HTML parser; fall back to the regex scan when unavailable
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 
 
 API_ENDPOINT = "https://app.rakuten.co.jp/services/api/Recipe/CategoryRanking/20170426"
 CATEGORY_LIST_ENDPOINT = "https://app.rakuten.co.jp/services/api/Recipe/CategoryList/20170426"
 
+# Precompiled patterns (used on every recipe page / suggestion query)
+_JSONLD_RE = re.compile(r'<script[^>]+type="application/ld\+json"[^>]*>(.*?)</script>', re.S | re.I)
+_TOKEN_SPLIT_RE = re.compile(r"[\s\u3000,、/・]+")
+_JSONLD_BYTES_RE = re.compile(rb'<script[^>]+type="application/ld\+json"[^>]*>(.*?)</script>', re.S | re.I)
+_JSONLD_OPENER = b"application/ld+json"
+_SCRIPT_CLOSE = b"</script>"
+
+# Shared session: reuse TCP/TLS connections to the same host across fetches.
+_DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "recipe_app/1.0",
+    "Connection": "keep-alive",
+}
+
+
+# Transient failures (429/5xx, connection errors) are retried by urllib3 with
+# exponential backoff, honouring Retry-After.
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF = 0.6
+
+
+def _make_session() -> requests.Session:
+    s = requests.Session()
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    s.mount("https://", adapter)
+    s.headers.update(_DEFAULT_HEADERS)
+    return s
+
+
+_SESSION = _make_session()
+
+
+# -----------------------------
+# On-disk response cache with TTL (+ in-process layer)
+# -----------------------------
+CACHE_DIR = Path(os.getenv("RECIPE_CACHE_DIR") or Path.home() / ".cache" / "recipe_app")
+CATEGORY_LIST_TTL = 86400    # category tree rarely changes
+CATEGORY_RANKING_TTL = 3600  # rankings update at most hourly
+RECIPE_PAGE_TTL = 604800     # scraped recipe details
+
+# LRU-bounded: the web app calls the fetchers from a long-lived worker
+MEM_CACHE_MAX_ENTRIES = 256
+_MEM_CACHE: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_MEM_CACHE_LOCK = threading.Lock()
+
+
+def _mem_cache_get(key: str, ttl: float, now: float) -> Any:
+    """Return the in-process entry for key if still fresh; expired entries are dropped."""
+    with _MEM_CACHE_LOCK:
+        hit = _MEM_CACHE.get(key)
+        if hit is None:
+            return None
+        if now - hit[0] >= ttl:
+            del _MEM_CACHE[key]
+            return None
+        _MEM_CACHE.move_to_end(key)
+        return hit[1]
+
+
+def _mem_cache_set(key: str, ts: float, data: Any) -> None:
+    with _MEM_CACHE_LOCK:
+        _MEM_CACHE[key] = (ts, data)
+        _MEM_CACHE.move_to_end(key)
+        while len(_MEM_CACHE) > MEM_CACHE_MAX_ENTRIES:
+            _MEM_CACHE.popitem(last=False)
+
+
+def _cache_path(key: str) -> Path:
+    return CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+
+def _cache_read(key: str) -> Optional[Dict[str, Any]]:
+    """Return the on-disk entry for key regardless of age, or None."""
+    try:
+        entry = orjson.loads(_cache_path(key).read_bytes())
+        entry["ts"] = float(entry["ts"])
+    except Exception:
+        return None
+    return entry if "data" in entry else None
+
+
+def _cache_get(key: str, ttl: float) -> Any:
+    """Return cached data for key if younger than ttl seconds, else None."""
+    now = time.time()
+    data = _mem_cache_get(key, ttl, now)
+    if data is not None:
+        return data
+    entry = _cache_read(key)
+    if entry is None or now - entry["ts"] >= ttl:
+        return None
+    _mem_cache_set(key, entry["ts"], entry["data"])
+    return entry["data"]
+
+
+def _cache_put(key: str, data: Any, validators: Optional[Dict[str, str]] = None) -> None:
+    """Store data for key (plus HTTP validators, if any); write failures are ignored."""
+    ts = time.time()
+    _mem_cache_set(key, ts, data)
+    path = _cache_path(key)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    entry: Dict[str, Any] = {"ts": ts, "data": data}
+    if validators:
+        entry["validators"] = validators
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(orjson.dumps(entry))
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[WARN] Failed to write cache {path}: {e}")
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+
 def fetch_category_list(
     app_id: str,
     timeout_sec: int = 15,
-    max_retries: int = 3,
-    sleep_base: float = 0.6,
+    session: Optional[requests.Session] = None,
 ) -> Optional[Dict[str, Any]]:
     """Fetch Rakuten Recipe CategoryList JSON."""
+    http = session or _SESSION
     params = {"format": "json", "applicationId": app_id}
     url = f"{CATEGORY_LIST_ENDPOINT}?{urlencode(params)}"
 
-    last_err = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            r = requests.get(url, timeout=timeout_sec)
-            if r.status_code in (429, 500, 502, 503, 504):
-                time.sleep(sleep_base * attempt + random.random() * 0.3)
-                continue
-            r.raise_for_status()
-            data = r.json()
-            if isinstance(data, dict) and "error" in data:
-                last_err = RuntimeError(f"API error: {data}")
-                time.sleep(sleep_base * attempt + random.random() * 0.3)
-                continue
-            return data
-        except Exception as e:
-            last_err = e
-            time.sleep(sleep_base * attempt + random.random() * 0.3)
-
-    print(f"[WARN] Failed category list: {last_err}")
-    return None
+    cached = _cache_get(url, CATEGORY_LIST_TTL)
+    if cached is not None:
+        return cached
+
+    try:
+        r = http.get(url, timeout=timeout_sec)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+    except Exception as e:
+        print(f"[WARN] Failed category list: {e}")
+        return None
+
+    if isinstance(data, dict) and "error" in data:
+        print(f"[WARN] Failed category list: API error: {data}")
+        return None
+
+    _cache_put(url, data)
+    return data
 
 
 def _flatten_categories(cat_json: Dict[str, Any]) -> List[Dict[str, str]]:
@@ -61,7 +194,8 @@ def _flatten_categories(cat_json: Dict[str, Any]) -> List[Dict[str, str]]:
     large_by_id = {str(c.get("categoryId")): c for c in large if c.get("categoryId") is not None}
     medium_by_id = {str(c.get("categoryId")): c for c in medium if c.get("categoryId") is not None}
 
-    out: List[Dict[str, str]] = []
+    # Keyed by categoryId so duplicates are dropped in the same pass (first one wins)
+    out: Dict[str, Dict[str, str]] = {}
 
     # large
     for c in large:
@@ -69,7 +203,10 @@ def _flatten_categories(cat_json: Dict[str, Any]) -> List[Dict[str, str]]:
         name = c.get("categoryName")
         if cid is None or not name:
             continue
-        out.append({"categoryId": str(cid), "name": str(name), "path": str(name)})
+        cid_s = str(cid)
+        if cid_s not in out:
+            name_s = str(name)
+            out[cid_s] = {"categoryId": cid_s, "name": name_s, "path": name_s}
 
     # medium
     for c in medium:
@@ -79,16 +216,22 @@ def _flatten_categories(cat_json: Dict[str, Any]) -> List[Dict[str, str]]:
         if cid is None or parent is None or not name:
             continue
 
-        parent_name = large_by_id.get(str(parent), {}).get("categoryName")
-        path = f"{parent_name}>{name}" if parent_name else str(name)
+        parent_s = str(parent)
+        cid_s = str(cid)
+        api_id = "-".join((parent_s, cid_s))   # ★ここが本体
+        if api_id in out:
+            continue
+
+        name_s = str(name)
+        parent_name = large_by_id.get(parent_s, {}).get("categoryName")
+        path = ">".join((str(parent_name), name_s)) if parent_name else name_s
 
-        api_id = f"{parent}-{cid}"   # ★ここが本体
-        out.append({
+        out[api_id] = {
             "categoryId": api_id,         # ★ランキングに投げるID
-            "displayId": str(cid),        # （表示用）
-            "name": str(name),
+            "displayId": cid_s,           # （表示用）
+            "name": name_s,
             "path": path
-        })
+        }
 
     # small
 # small
@@ -99,45 +242,88 @@ def _flatten_categories(cat_json: Dict[str, Any]) -> List[Dict[str, str]]:
         if cid is None or parent is None or not name:
             continue
 
-        med = medium_by_id.get(str(parent), {})
+        parent_s = str(parent)
+        med = medium_by_id.get(parent_s, {})
         med_name = med.get("categoryName")
         large_parent = med.get("parentCategoryId")  # largeId
-        large_name = large_by_id.get(str(large_parent), {}).get("categoryName") if large_parent is not None else None
-
-        if large_name and med_name:
-            path = f"{large_name}>{med_name}>{name}"
-        elif med_name:
-            path = f"{med_name}>{name}"
-        else:
-            path = str(name)
-
         if large_parent is None:
             continue
 
-        api_id = f"{large_parent}-{parent}-{cid}"  # ★ここが本体
-        out.append({
+        large_parent_s = str(large_parent)
+        cid_s = str(cid)
+        api_id = "-".join((large_parent_s, parent_s, cid_s))  # ★ここが本体
+        if api_id in out:
+            continue
+
+        name_s = str(name)
+        if med_name:
+            large_name = large_by_id.get(large_parent_s, {}).get("categoryName")
+            # 大 is only shown together with 中 (大>小 is never built)
+            parts = (str(large_name), str(med_name), name_s) if large_name else (str(med_name), name_s)
+            path = ">".join(parts)
+        else:
+            path = name_s
+
+        out[api_id] = {
             "categoryId": api_id,      # ★ランキングに投げるID
-            "displayId": str(cid),
-            "name": str(name),
+            "displayId": cid_s,
+            "name": name_s,
             "path": path
-        })
+        }
+
+    return list(out.values())
+
+
+# (cat_json object, indexed categories) for the most recent category list.
+# Holding the object itself (not its id) keeps the identity check safe.
+_INDEXED_CATEGORIES: Optional[Tuple[Dict[str, Any], List[Tuple[Dict[str, str], str]]]] = None
 
 
-    # Dedup by id (keep first)
-    seen = set()
-    deduped: List[Dict[str, str]] = []
-    for c in out:
-        if c["categoryId"] in seen:
+def _index_categories(cat_json: Dict[str, Any]) -> List[Tuple[Dict[str, str], str]]:
+    """Flatten categories and pair each with its lowercased search text.
+
+    fetch_category_list serves the same object while its cache entry is fresh,
+    so the work is done once per category list rather than once per query.
+    """
+    global _INDEXED_CATEGORIES
+    cached = _INDEXED_CATEGORIES
+    if cached is not None and cached[0] is cat_json:
+        return cached[1]
+    indexed = [
+        (c, f"{c.get('name','')} {c.get('path','')}".lower())
+        for c in _flatten_categories(cat_json)
+    ]
+    _INDEXED_CATEGORIES = (cat_json, indexed)
+    return indexed
+
+
+def _score_categories(
+    indexed: List[Tuple[Dict[str, str], str]],
+    q_low: str,
+    tokens: Tuple[str, ...],
+) -> List[Tuple[int, int, int]]:
+    """Score each indexed category against the query.
+
+    Returns (score, path_len, idx) for every category that scores at all;
+    idx points back into `indexed`. Kept free of dict building so the hot
+    loop stays small (and plain enough for mypyc to compile as-is).
+    """
+    scored: List[Tuple[int, int, int]] = []
+    for idx, (c, text) in enumerate(indexed):
+        full_hit = q_low in text
+        # Skip categories that cannot score before doing the counting pass
+        if not full_hit and not any(t in text for t in tokens):
             continue
-        seen.add(c["categoryId"])
-        deduped.append(c)
-    return deduped
+        score = (5 if full_hit else 0) + 2 * sum(1 for t in tokens if t in text)
+        scored.append((score, len(c["path"]), idx))
+    return scored
 
 
 def suggest_categories(
     app_id: str,
     query: str,
     limit: int = 8,
+    session: Optional[requests.Session] = None,
 ) -> List[Dict[str, Any]]:
     """Very simple 'natural language' -> category suggestions.
 
@@ -150,32 +336,24 @@ def suggest_categories(
     if not q:
         return []
 
-    cat_json = fetch_category_list(app_id)
+    cat_json = fetch_category_list(app_id, session=session)
     if not cat_json:
         return []
 
-    cats = _flatten_categories(cat_json)
+    indexed = _index_categories(cat_json)
 
     # tokens: split on whitespace + common separators
-    tokens = re.split(r"[\s\u3000,、/・]+", q)
-    tokens = [t for t in (t.strip().lower() for t in tokens) if t]
+    tokens = _TOKEN_SPLIT_RE.split(q)
+    tokens = tuple(t for t in (t.strip().lower() for t in tokens) if t)
 
     q_low = q.lower()
 
-    scored: List[Dict[str, Any]] = []
-    for c in cats:
-        text = f"{c.get('name','')} {c.get('path','')}".lower()
-        score = 0
-        if q_low in text:
-            score += 5
-        for t in tokens:
-            if t and t in text:
-                score += 2
-        if score > 0:
-            scored.append({**c, "score": score})
+    scored = _score_categories(indexed, q_low, tokens)
 
-    scored.sort(key=lambda x: (-int(x.get("score", 0)), len(x.get("path",""))))
-    return scored[:limit]
+    # Only the top `limit` are needed: O(N log k) instead of a full sort.
+    # idx breaks ties in list order; result dicts are built for the winners only.
+    top = heapq.nsmallest(limit, scored, key=lambda x: (-x[0], x[1], x[2]))
+    return [{**indexed[idx][0], "score": score} for score, _, idx in top]
 
 
 # -----------------------------
@@ -183,101 +361,197 @@ def suggest_categories(
 # -----------------------------
 _RECIPE_URL_TEMPLATE = "https://recipe.rakuten.co.jp/recipe/{recipe_id}/"
 
+
+def _iter_jsonld_blocks(html: Union[str, bytes]) -> Iterator[Union[str, bytes]]:
+    """Yield the text of each <script type="application/ld+json"> block in page order.
+
+    Accepts the page as str or raw bytes. Lazy so the caller can stop at the
+    first Recipe block.
+    """
+    if HTMLParser is not None:
+        for node in HTMLParser(html).css('script[type="application/ld+json"]'):
+            yield node.text()
+        return
+    pattern = _JSONLD_BYTES_RE if isinstance(html, bytes) else _JSONLD_RE
+    for m in pattern.finditer(html):
+        yield m.group(1)
+
+
+def _recipe_object(block: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+    """Return the first Recipe-typed object in one JSON-LD block's text, or None."""
+    # Breadcrumb/Organization blocks come first on most pages; a Recipe
+    # block always spells out "Recipe" as a JSON string, so skip the rest unparsed
+    if (b'"Recipe"' if isinstance(block, bytes) else '"Recipe"') not in block:
+        return None
+    try:
+        data = orjson.loads(block)
+    except Exception:
+        return None
+
+    # data can be dict or list
+    candidates = data if isinstance(data, list) else [data]
+    for obj in candidates:
+        if not isinstance(obj, dict):
+            continue
+        t = obj.get("@type") or obj.get("@TYPE")
+        if t == "Recipe" or (isinstance(t, list) and "Recipe" in t):
+            return obj
+    return None
+
+
+def _recipe_from_jsonld(obj: Dict[str, Any], rid: str, url: str) -> Dict[str, Any]:
+    """Build the app's recipe dict from a JSON-LD Recipe object."""
+    name = obj.get("name") or ""
+    desc = obj.get("description") or ""
+    ingredients = obj.get("recipeIngredient") or []
+    if not isinstance(ingredients, list):
+        ingredients = []
+    image = obj.get("image")
+    if isinstance(image, list) and image:
+        image_url = str(image[0])
+    elif isinstance(image, str):
+        image_url = image
+    else:
+        image_url = None
+
+    return {
+        "recipeId": int(rid),
+        "title": name,
+        "description": desc,
+        "materials": ingredients,
+        "time": obj.get("totalTime") or "指定なし",
+        "cost": "指定なし",
+        "rank": "999",
+        "pickup": 0,
+        "image": image_url,
+        "url": url,
+        "publishDay": "unknown",
+        "nickname": "unknown",
+        "shop": 0,
+        "sourceCategoryId": "manual",
+    }
+
+
+def _find_recipe_object(html: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+    """Return the first JSON-LD Recipe object in html, or None."""
+    for b in _iter_jsonld_blocks(html):
+        obj = _recipe_object(b)
+        if obj is not None:
+            return obj
+    return None
+
+
+def _parse_recipe_page(html: Union[str, bytes], rid: str, url: str) -> Optional[Dict[str, Any]]:
+    """Build the app's recipe dict from the first JSON-LD Recipe object in html."""
+    obj = _find_recipe_object(html)
+    return _recipe_from_jsonld(obj, rid, url) if obj is not None else None
+
+
+def _read_until_recipe_jsonld(
+    r: requests.Response, chunk_size: int = 16384
+) -> Tuple[bytearray, Optional[Dict[str, Any]]]:
+    """Read a streamed page body, stopping once a complete Recipe JSON-LD block has arrived.
+
+    Only newly received bytes are searched for an ld+json opener and its
+    closing </script>. When a finished block mentions "Recipe", that <script>
+    element goes to the HTML parser, and reading stops only if it yields
+    a Recipe-typed object (the same test _parse_recipe_page applies). That
+    object is returned with the buffer, or None once the whole body has been
+    read without one. The JSON-LD sits in <head> on recipe pages, so the
+    rest of the document (usually most of its size) is never downloaded.
+    """
+    buf = bytearray()
+    scan_from = 0
+    block_start = -1
+    for chunk in r.iter_content(chunk_size=chunk_size):
+        buf += chunk
+        while True:
+            if block_start < 0:
+                block_start = buf.find(_JSONLD_OPENER, scan_from)
+                if block_start < 0:
+                    # Keep an overlap in case the opener straddles two chunks
+                    scan_from = max(scan_from, len(buf) - len(_JSONLD_OPENER) + 1)
+                    break
+                scan_from = block_start + len(_JSONLD_OPENER)
+            end = buf.find(_SCRIPT_CLOSE, scan_from)
+            if end < 0:
+                scan_from = max(scan_from, len(buf) - len(_SCRIPT_CLOSE) + 1)
+                break
+            scan_from = end + len(_SCRIPT_CLOSE)
+            opener, block_start = block_start, -1
+            if buf.find(b'"Recipe"', opener, end) >= 0:
+                # Parse just this finished <script> element, not the whole prefix
+                tag_start = max(0, buf.rfind(b"<script", 0, opener))
+                obj = _find_recipe_object(bytes(buf[tag_start:scan_from]))
+                if obj is not None:
+                    return buf, obj
+    return buf, None
+
+
 def fetch_recipe_by_id(
     recipe_id: str,
     timeout_sec: int = 15,
-    max_retries: int = 3,
-    sleep_base: float = 0.6,
+    session: Optional[requests.Session] = None,
 ) -> Optional[Dict[str, Any]]:
     """Fetch a single recipe by scraping the public recipe page's JSON-LD.
 
     Rakuten's official Recipe APIs center on categories/rankings.
     This helper is a pragmatic fallback when you already know recipeId.
     """
+    http = session or _SESSION
     rid = str(recipe_id).strip()
     if not rid.isdigit():
         return None
 
     url = _RECIPE_URL_TEMPLATE.format(recipe_id=rid)
 
-    last_err = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            r = requests.get(url, timeout=timeout_sec, headers={"User-Agent": "Mozilla/5.0"})
-            if r.status_code in (429, 500, 502, 503, 504):
-                time.sleep(sleep_base * attempt + random.random() * 0.3)
-                continue
+    cached = _cache_get(url, RECIPE_PAGE_TTL)
+    if cached is not None:
+        return cached
+
+    # An expired entry can still be revalidated: a 304 costs no page body
+    headers = {"User-Agent": "Mozilla/5.0"}
+    stale = _cache_read(url)
+    validators = (stale or {}).get("validators") or {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        with http.get(url, timeout=timeout_sec, headers=headers, stream=True) as r:
+            if r.status_code == 304 and stale is not None:
+                _cache_put(url, stale["data"], validators)
+                return stale["data"]
             r.raise_for_status()
-            html = r.text
-
-            # Find JSON-LD blocks
-            blocks = re.findall(r'<script[^>]+type="application/ld\+json"[^>]*>(.*?)</script>', html, flags=re.S|re.I)
-            for b in blocks:
-                b = b.strip()
-                if not b:
-                    continue
-                try:
-                    data = json.loads(b)
-                except Exception:
-                    continue
-
-                # data can be dict or list
-                candidates = data if isinstance(data, list) else [data]
-                for obj in candidates:
-                    if not isinstance(obj, dict):
-                        continue
-                    t = obj.get("@type") or obj.get("@TYPE")
-                    if t == "Recipe" or (isinstance(t, list) and "Recipe" in t):
-                        name = obj.get("name") or ""
-                        desc = obj.get("description") or ""
-                        ingredients = obj.get("recipeIngredient") or []
-                        if not isinstance(ingredients, list):
-                            ingredients = []
-                        image = obj.get("image")
-                        if isinstance(image, list) and image:
-                            image_url = str(image[0])
-                        elif isinstance(image, str):
-                            image_url = image
-                        else:
-                            image_url = None
-
-                        return {
-                            "recipeId": int(rid),
-                            "title": name,
-                            "description": desc,
-                            "materials": ingredients,
-                            "time": obj.get("totalTime") or "指定なし",
-                            "cost": "指定なし",
-                            "rank": "999",
-                            "pickup": 0,
-                            "image": image_url,
-                            "url": url,
-                            "publishDay": "unknown",
-                            "nickname": "unknown",
-                            "shop": 0,
-                            "sourceCategoryId": "manual",
-                        }
-
-            return None
-        except Exception as e:
-            last_err = e
-            time.sleep(sleep_base * attempt + random.random() * 0.3)
+            body, obj = _read_until_recipe_jsonld(r)
+            validators = {}
+            if r.headers.get("ETag"):
+                validators["etag"] = r.headers["ETag"]
+            if r.headers.get("Last-Modified"):
+                validators["last_modified"] = r.headers["Last-Modified"]
+    except Exception as e:
+        print(f"[WARN] Failed recipeId={rid}: {e}")
+        return None
 
-    print(f"[WARN] Failed recipeId={rid}: {last_err}")
-    return None
+    # No block matched while streaming: let the HTML parser try the full page
+    recipe = _recipe_from_jsonld(obj, rid, url) if obj is not None else _parse_recipe_page(bytes(body), rid, url)
+    if recipe is not None:
+        _cache_put(url, recipe, validators)
+    return recipe
 
 
 def fetch_category_ranking(
     app_id: str,
     category_id: str,
     timeout_sec: int = 15,
-    max_retries: int = 3,
-    sleep_base: float = 0.6,
+    session: Optional[requests.Session] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Fetch Rakuten Recipe CategoryRanking JSON.
     Returns dict on success, None on failure.
     """
+    http = session or _SESSION
     params = {
         "format": "json",
         "applicationId": app_id,
@@ -285,31 +559,25 @@ def fetch_category_ranking(
     }
     url = f"{API_ENDPOINT}?{urlencode(params)}"
 
-    last_err = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            r = requests.get(url, timeout=timeout_sec)
-            # Rate limit / transient errors
-            if r.status_code in (429, 500, 502, 503, 504):
-                time.sleep(sleep_base * attempt + random.random() * 0.3)
-                continue
-
-            r.raise_for_status()
-            data = r.json()
+    cached = _cache_get(url, CATEGORY_RANKING_TTL)
+    if cached is not None:
+        return cached
 
-            # Sometimes API returns error fields; be defensive
-            if isinstance(data, dict) and "error" in data:
-                last_err = RuntimeError(f"API error: {data}")
-                time.sleep(sleep_base * attempt + random.random() * 0.3)
-                continue
+    try:
+        r = http.get(url, timeout=timeout_sec)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+    except Exception as e:
+        print(f"[WARN] Failed categoryId={category_id}: {e}")
+        return None
 
-            return data
-        except Exception as e:
-            last_err = e
-            time.sleep(sleep_base * attempt + random.random() * 0.3)
+    # Sometimes API returns error fields; be defensive
+    if isinstance(data, dict) and "error" in data:
+        print(f"[WARN] Failed categoryId={category_id}: API error: {data}")
+        return None
 
-    print(f"[WARN] Failed categoryId={category_id}: {last_err}")
-    return None
+    _cache_put(url, data)
+    return data
 
 
 def normalize_recipe(item: Dict[str, Any], source_category_id: str) -> Dict[str, Any]:
@@ -334,53 +602,105 @@ def normalize_recipe(item: Dict[str, Any], source_category_id: str) -> Dict[str,
     }
 
 
+class _Throttle:
+    """Space out request start times across worker threads (simple rate cap)."""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = max(0.0, min_interval)
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, cancel: Optional[threading.Event] = None) -> bool:
+        """Block until this caller's start slot; False if `cancel` was set meanwhile."""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if cancel is None:
+            if delay > 0:
+                time.sleep(delay)
+            return True
+        return not cancel.wait(delay) if delay > 0 else not cancel.is_set()
+
+
 def build_stock(
     app_id: str,
     category_ids: List[str],
     target_count: int = 200,
     per_request_sleep: float = 0.8,
+    session: Optional[requests.Session] = None,
+    max_workers: int = 4,
 ) -> Dict[str, Any]:
     """
     Collect recipes across multiple categories until target_count reached.
     Deduplicates by recipeId.
+
+    Category rankings are fetched by up to max_workers threads sharing one
+    session. Request starts stay per_request_sleep apart overall (the same
+    rate as fetching one by one); the workers only overlap round-trips.
     """
-    recipes_by_id: Dict[str, Dict[str, Any]] = {}
+    # Keyed on the API's own recipeId (an int), so no str() per item
+    recipes_by_id: Dict[int, Dict[str, Any]] = {}
     stats = {"requestedCategories": 0, "fetchedItems": 0, "deduped": 0}
 
     # Shuffle to diversify early results
     category_ids = category_ids[:]
     random.shuffle(category_ids)
 
-    for cid in category_ids:
-        if len(recipes_by_id) >= target_count:
-            break
+    http = session or _SESSION
+    max_workers = max(1, max_workers)
+    throttle = _Throttle(per_request_sleep)
+    pending_ids = iter(category_ids)
+    # Set once the target is reached so workers still waiting for their
+    # throttle slot give up instead of issuing a request nobody will use.
+    target_reached = threading.Event()
 
-        data = fetch_category_ranking(app_id, cid)
-        stats["requestedCategories"] += 1
+    def fetch(cid: str):
+        if not throttle.wait(target_reached):
+            return None
+        return cid, fetch_category_ranking(app_id, cid, session=http)
+
+    # Keep at most max_workers categories in flight and stop submitting once
+    # the target is reached. Results are merged on this thread only.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        while True:
+            while len(in_flight) < max_workers and len(recipes_by_id) < target_count:
+                cid = next(pending_ids, None)
+                if cid is None:
+                    break
+                in_flight.add(executor.submit(fetch, cid))
+            if not in_flight:
+                break
 
-        if not data or "result" not in data:
-            time.sleep(per_request_sleep)
-            continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                res = fut.result()
+                if res is None:
+                    continue
+                cid, data = res
+                stats["requestedCategories"] += 1
 
-        items = data.get("result") or []
-        stats["fetchedItems"] += len(items)
+                if len(recipes_by_id) >= target_count or not data or "result" not in data:
+                    continue
 
-        for item in items:
-            rid = item.get("recipeId")
-            if rid is None:
-                continue
-            rid_str = str(rid)
+                items = data.get("result") or []
+                stats["fetchedItems"] += len(items)
 
-            if rid_str in recipes_by_id:
-                stats["deduped"] += 1
-                continue
+                for item in items:
+                    rid = item.get("recipeId")
+                    if rid is None:
+                        continue
 
-            recipes_by_id[rid_str] = normalize_recipe(item, cid)
+                    if rid in recipes_by_id:
+                        stats["deduped"] += 1
+                        continue
 
-            if len(recipes_by_id) >= target_count:
-                break
+                    recipes_by_id[rid] = normalize_recipe(item, cid)
 
-        time.sleep(per_request_sleep)
+                    if len(recipes_by_id) >= target_count:
+                        target_reached.set()
+                        break
 
     return {
         "meta": {
@@ -420,8 +740,11 @@ def main():
         per_request_sleep=0.8,  # 連打しないためのウェイト
     )
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(stock, f, ensure_ascii=False, indent=2)
+    # orjson writes UTF-8 bytes directly (same as ensure_ascii=False);
+    # default=str keeps any odd API value from aborting the whole dump
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(stock, option=option, default=str))
 
     print(f"[OK] Saved: {output_path}")
     print(f"     actualCount = {stock['meta']['actualCount']}")